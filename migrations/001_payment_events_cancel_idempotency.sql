@@ -0,0 +1,38 @@
+-- One CANCEL_REQUESTED event per (payment, idempotency key).
+-- Backs the ON CONFLICT target in cancel_payment, turning the replay check into an
+-- index lookup instead of a scan + JSON extract over the payment's events.
+-- Requests without an idempotency key store NULL and are never deduplicated.
+-- CONCURRENTLY cannot run inside a transaction block; run this file on its own.
+
+-- The check-then-insert this replaces could race, so existing data may already hold
+-- repeated keyed cancels, which would fail the unique build. Keep the earliest event
+-- per key and move the key of later copies to duplicate_idempotency_key, so the audit
+-- rows stay but drop out of the index. Safe to re-run.
+UPDATE payment_events
+SET meta = (meta - 'idempotency_key')
+    || jsonb_build_object('duplicate_idempotency_key', meta->>'idempotency_key')
+WHERE ctid IN (
+    SELECT ctid
+    FROM (
+        SELECT
+            ctid,
+            row_number() OVER (
+                PARTITION BY payment_id, meta->>'idempotency_key'
+                ORDER BY created_at, ctid
+            ) AS n
+        FROM payment_events
+        WHERE event_type = 'CANCEL_REQUESTED'
+          AND meta->>'idempotency_key' IS NOT NULL
+    ) keyed
+    WHERE n > 1
+);
+
+-- A failed CONCURRENTLY build (e.g. a duplicate inserted by the old code while it ran)
+-- leaves an INVALID index behind, which IF NOT EXISTS would then accept silently and
+-- ON CONFLICT would reject at runtime. Check before deploying the new code:
+--   SELECT indisvalid FROM pg_index WHERE indexrelid = 'idx_pe_cancel_idem'::regclass;
+-- and if it is false, drop it and run this file again:
+--   DROP INDEX CONCURRENTLY IF EXISTS idx_pe_cancel_idem;
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_pe_cancel_idem
+    ON payment_events (payment_id, ((meta->>'idempotency_key')))
+    WHERE event_type = 'CANCEL_REQUESTED';
@@ -0,0 +1,15 @@
+-- Transactional outbox for Pub/Sub commands.
+-- create_pay writes the command here in the same statement that claims dispatch, and
+-- app.outbox drains unpublished rows in the background, so a crash between commit
+-- and publish can no longer lose a command. Delivery is at-least-once. Published rows
+-- are deleted (see migrations/005); published_at is only set by the earlier drainer.
+CREATE TABLE IF NOT EXISTS outbox (
+    id            bigserial PRIMARY KEY,
+    payment_id    uuid NOT NULL,
+    topic         text NOT NULL,
+    attrs         jsonb NOT NULL DEFAULT '{}'::jsonb,
+    payload       bytea NOT NULL,
+    ordering_key  text NOT NULL,
+    created_at    timestamptz NOT NULL DEFAULT now(),
+    published_at  timestamptz
+);
@@ -0,0 +1,3 @@
+-- gen_random_uuid() is built in from PostgreSQL 13; on older servers it comes from
+-- pgcrypto. The gift payment insert generates payment_id with it.
+CREATE EXTENSION IF NOT EXISTS pgcrypto;
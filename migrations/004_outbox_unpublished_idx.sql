@@ -0,0 +1,6 @@
+-- The outbox drainer only ever reads unpublished rows, oldest first (CLAIM_OUTBOX_SQL).
+-- A partial index keeps that scan off the published history, which only grows.
+-- CONCURRENTLY cannot run inside a transaction block; run this file on its own.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_outbox_unpublished
+    ON outbox (id)
+    WHERE published_at IS NULL;
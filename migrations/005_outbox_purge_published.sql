@@ -0,0 +1,5 @@
+-- app.outbox now deletes rows once they are published (DELETE_PUBLISHED_OUTBOX_SQL);
+-- their DISPATCHED payment_events keep the payload. Clear the history left by the
+-- earlier drainer, which only set published_at. Safe to re-run.
+DELETE FROM outbox
+WHERE published_at IS NOT NULL;
@@ -1,9 +1,23 @@
 import os
-from google.cloud.sql.connector import Connector, IPTypes
+
+import asyncpg
+import orjson
+from fastapi import Request
+from google.cloud.sql.connector import Connector, IPTypes, create_async_connector
+
+from app import settings
+from app.queries import HOT_STATEMENTS
 
 _connector = None
 
 
+class PaymentsConnection(asyncpg.Connection):
+    # Plain asyncpg connections use __slots__; this subclass can carry its prepared statements.
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.hot: dict[str, asyncpg.prepared_stmt.PreparedStatement] = {}
+
+
 def _get_required_env(name: str) -> str:
     value = os.getenv(name)
     if not value:
@@ -11,18 +25,94 @@ def _get_required_env(name: str) -> str:
     return value
 
 
-def _get_connector() -> Connector:
+async def _get_connector() -> Connector:
     global _connector
     if _connector is None:
-        _connector = Connector()
+        # The async connector binds to the running loop, so it is created lazily inside it.
+        _connector = await create_async_connector()
     return _connector
 
-def get_conn():
-    return _get_connector().connect(
-        _get_required_env("INSTANCE_CONNECTION_NAME"),
-        "pg8000",
+
+async def _connect(instance_connection_name: str, **kwargs) -> asyncpg.Connection:
+    connector = await _get_connector()
+    return await connector.connect_async(
+        instance_connection_name,
+        "asyncpg",
         user=_get_required_env("DB_USER"),
         password=_get_required_env("DB_PASS"),
         db=_get_required_env("DB_NAME"),
         ip_type=IPTypes.PUBLIC,
+        **kwargs,
+    )
+
+
+def _encode_jsonb(value) -> bytes:
+    # jsonb's binary wire format is a version byte followed by the JSON text. bytes are
+    # taken as an already-encoded document (e.g. a stored command payload) and sent as-is.
+    return b"\x01" + (value if isinstance(value, bytes) else orjson.dumps(value))
+
+
+def _decode_jsonb(data: bytes):
+    return orjson.loads(data[1:])
+
+
+async def _init_connection(conn: PaymentsConnection) -> None:
+    # Runs once per physical connection. jsonb binds and columns go through orjson as
+    # Python objects; the codec must be in place before anything is prepared.
+    await conn.set_type_codec(
+        "jsonb",
+        encoder=_encode_jsonb,
+        decoder=_decode_jsonb,
+        schema="pg_catalog",
+        format="binary",
+    )
+    # Preparing here means the hot paths never parse or plan on the request.
+    for name, sql in HOT_STATEMENTS.items():
+        conn.hot[name] = await conn.prepare(sql)
+
+
+def _connection_kwargs() -> dict:
+    if settings.DB_PGBOUNCER_HOST:
+        # PgBouncer keeps named prepared statements valid across transactions only with
+        # max_prepared_statements set, which the hot statements rely on. Without the
+        # connector's TLS, ssl must be explicit: asyncpg's default "prefer" would fall
+        # back to plaintext.
+        return {
+            "host": settings.DB_PGBOUNCER_HOST,
+            "port": settings.DB_PGBOUNCER_PORT,
+            "ssl": settings.DB_PGBOUNCER_SSL,
+            "user": _get_required_env("DB_USER"),
+            "password": _get_required_env("DB_PASS"),
+            "database": _get_required_env("DB_NAME"),
+        }
+    return {
+        "dsn": _get_required_env("INSTANCE_CONNECTION_NAME"),
+        "connect": _connect,
+    }
+
+
+async def create_pool() -> asyncpg.Pool:
+    return await asyncpg.create_pool(
+        **_connection_kwargs(),
+        connection_class=PaymentsConnection,
+        init=_init_connection,
+        min_size=settings.DB_POOL_MIN_SIZE,
+        max_size=settings.DB_POOL_MAX_SIZE,
+        max_inactive_connection_lifetime=settings.DB_POOL_MAX_INACTIVE_CONNECTION_LIFETIME,
+        statement_cache_size=settings.DB_STATEMENT_CACHE_SIZE,
+        command_timeout=settings.DB_COMMAND_TIMEOUT,
     )
+
+
+async def close_pool(pool: asyncpg.Pool) -> None:
+    global _connector
+    await pool.close()
+    if _connector is not None:
+        await _connector.close_async()
+        _connector = None
+
+
+async def get_db_conn(request: Request):
+    # Request-scoped connection borrowed from the pool built in the app lifespan.
+    async with request.app.state.pool.acquire() as conn:
+        yield conn
@@ -12,6 +12,12 @@ def get_db_error_code(exc: Exception) -> str | None:
 def get_db_error_message(exc: Exception) -> str:
     messages: list[str] = []
 
+    # asyncpg exposes the server fields as attributes rather than a dict in args.
+    for attr in ("constraint_name", "detail"):
+        value = getattr(exc, attr, None)
+        if value:
+            messages.append(str(value))
+
     for arg in getattr(exc, "args", ()):
         if isinstance(arg, dict):
             message = arg.get("M") or arg.get("message") or arg.get("detail")
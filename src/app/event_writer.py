@@ -0,0 +1,62 @@
+import asyncio
+import logging
+from datetime import datetime
+
+import asyncpg
+
+from app import settings
+
+
+logger = logging.getLogger(__name__)
+
+EVENT_COLUMNS = ("payment_id", "event_type", "message", "meta", "created_at")
+
+# Only informational events that need not commit with a payment state change belong
+# here: queued rows are lost if the process dies before they are flushed.
+_queue: asyncio.Queue = asyncio.Queue(maxsize=settings.EVENT_WRITER_QUEUE_SIZE)
+_STOP = object()
+
+
+async def enqueue_payment_event(
+    *,
+    payment_id: str,
+    event_type: str,
+    message: str | None,
+    meta: dict[str, object] | bytes,
+    created_at: datetime,
+) -> None:
+    await _queue.put((payment_id, event_type, message, meta, created_at))
+
+
+async def _copy_events(pool: asyncpg.Pool, records: list[tuple]) -> None:
+    try:
+        async with pool.acquire() as conn:
+            # Binary COPY: one round trip and one WAL-friendly bulk insert per batch.
+            await conn.copy_records_to_table(
+                "payment_events",
+                records=records,
+                columns=EVENT_COLUMNS,
+            )
+    except Exception:
+        logger.exception("EVENT WRITE FAILED: dropped %s payment_events rows", len(records))
+
+
+async def run_event_writer(pool: asyncpg.Pool) -> None:
+    while True:
+        batch = [await _queue.get()]
+        # Let concurrent requests add to the batch before it is flushed.
+        await asyncio.sleep(settings.EVENT_WRITER_FLUSH_INTERVAL)
+        while len(batch) < settings.EVENT_WRITER_BATCH_SIZE and not _queue.empty():
+            batch.append(_queue.get_nowait())
+
+        records = [record for record in batch if record is not _STOP]
+        if records:
+            await _copy_events(pool, records)
+        if len(records) != len(batch):
+            return
+
+
+async def stop_event_writer(writer: asyncio.Task) -> None:
+    # The stop marker queues behind every pending event, so the writer flushes them all first.
+    await _queue.put(_STOP)
+    await writer
@@ -6,3 +6,13 @@ ALLOWED_TRANSITIONS = {
     "FAILED": {"FAILED"},
     "CANCELED": {"CANCELED"},
 }
+
+# Inverse of ALLOWED_TRANSITIONS: target status -> statuses it may be reached from.
+# Lets the transition check run inside the UPDATE's WHERE clause.
+ALLOWED_PREDECESSORS = {
+    target: sorted(
+        source for source, targets in ALLOWED_TRANSITIONS.items() if target in targets
+    )
+    for targets in ALLOWED_TRANSITIONS.values()
+    for target in targets
+}
@@ -1,30 +1,27 @@
 # app/models/payments.py
-from pydantic import BaseModel, Field, conint, field_validator, model_validator
-from typing import Optional, Literal
+from pydantic import BaseModel, Field, StringConstraints, field_validator, model_validator
+from typing import Annotated, Optional, Literal
 from datetime import datetime
 
+# Constrained types shared by the models below; pydantic-core builds each validator once.
+PositiveCents = Annotated[int, Field(gt=0)]
+NonNegativeCents = Annotated[int, Field(ge=0)]
+IdempotencyKey = Annotated[str, StringConstraints(min_length=8, max_length=128)]
+# Status on responses built with model_construct from our own rows; nothing validates it there.
+ResponseStatus = str
+
 class PayRequest(BaseModel):
     merchant_id: str
     store_id: str
     terminal_id: str
     ecr_reference_number: str = Field(min_length=1, max_length=32)
     invoice_id: Optional[str] = None
-    amount: conint(gt=0)  # cents
-    idempotency_key: str = Field(min_length=8, max_length=128)
+    amount: PositiveCents  # cents
+    idempotency_key: IdempotencyKey
 
 class PayResponse(BaseModel):
     payment_id: str
-    status: Literal[
-        "IN_PROGRESS",
-        "APPROVED",
-        "DECLINED",
-        "FAILED",
-        "CANCELED",
-        "SETTLED",
-        "VOIDED",
-        "REFUNDED",
-        "SETTLEMENT_EXCEPTION",
-    ]
+    status: ResponseStatus
 
 
 # Gift requests use the subtype in `type`; the stored/published operation stays `GIFT`.
@@ -37,10 +34,10 @@ class GiftPaymentRequest(BaseModel):
     terminal_id: str
     ecr_reference_number: str = Field(min_length=1, max_length=32)
     type: GiftType
-    amount: Optional[conint(gt=0)] = None
+    amount: Optional[PositiveCents] = None
     invoice_id: str = Field(min_length=1, max_length=64)
     clerk_id: str = Field(min_length=1, max_length=64)
-    idempotency_key: str = Field(min_length=8, max_length=128)
+    idempotency_key: IdempotencyKey
 
     @model_validator(mode="after")
     def validate_amount_for_operation(self) -> "GiftPaymentRequest":
@@ -74,7 +71,7 @@ class GiftPaymentResponse(BaseModel):
 # for the status report
 
 class AmountResponse(BaseModel):
-    amount: Optional[conint(ge=0)] = None  # cents
+    amount: Optional[NonNegativeCents] = None  # cents
     currency: str
     debitCredit: Optional[Literal["DEBIT", "CREDIT"]] = None
 
@@ -91,17 +88,7 @@ class StatusResponse(BaseModel):
     operation: Optional[str] = None
     invoice_id: Optional[str] = None
     ecr_reference_number: Optional[str] = None
-    status: Literal[
-        "IN_PROGRESS",
-        "APPROVED",
-        "DECLINED",
-        "FAILED",
-        "CANCELED",
-        "SETTLED",
-        "VOIDED",
-        "REFUNDED",
-        "SETTLEMENT_EXCEPTION",
-    ]
+    status: ResponseStatus
     amount: AmountResponse
     response_code: Optional[str] = None
     response_message: Optional[str] = None
@@ -135,7 +122,7 @@ class PaymentEventRequest(BaseModel):
     occurred_at: datetime
 
     # Optional processor metadata
-    approved_amount: Optional[conint(ge=0)] = None
+    approved_amount: Optional[NonNegativeCents] = None
     debitCredit: Optional[Literal["DEBIT", "CREDIT"]] = None
 
     # Data coming from terminal and sale
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+
+import asyncpg
+
+from app import settings
+from app.event_writer import enqueue_payment_event
+from app.pubsub import publisher
+
+
+logger = logging.getLogger(__name__)
+
+# Event type and message per published operation, so a payment's history tells a VOID
+# dispatch apart from its PAY dispatch. PAY keeps the original DISPATCHED type.
+DISPATCH_EVENTS = {
+    "PAY": ("DISPATCHED", "Payment dispatched"),
+    "CANCEL": ("CANCEL_DISPATCHED", "Cancel dispatched"),
+    "VOID": ("VOID_DISPATCHED", "Void dispatched"),
+    "RETURN": ("RETURN_DISPATCHED", "Return dispatched"),
+}
+
+
+async def drain_outbox_once(pool: asyncpg.Pool) -> int:
+    # One drainer per ordering-key bucket across workers and instances
+    # (LOCK_OUTBOX_BUCKETS_SQL): a bucket's next pass starts only after this one's
+    # publishes settled or timed out and committed, so each terminal's commands leave
+    # in outbox order. Buckets held by other drainers are left to them.
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            buckets = await conn.hot["lock_outbox_buckets"].fetchval(settings.OUTBOX_LOCK_BUCKETS)
+            if not buckets:
+                return 0
+
+            rows = await conn.hot["claim_outbox"].fetch(
+                settings.OUTBOX_BATCH_SIZE, settings.OUTBOX_LOCK_BUCKETS, buckets
+            )
+            if not rows:
+                return 0
+
+            # Publish the whole batch before waiting so the client can coalesce it into few RPCs.
+            # publish() itself can raise (paused ordering key, flow control); that counts as a
+            # failed publish, and the key's later rows are held back so they cannot overtake it.
+            results = {}
+            pending = {}
+            held_keys = set()
+            for outbox_id, topic, attrs, payload, ordering_key in rows:
+                if ordering_key in held_keys:
+                    continue
+                try:
+                    pending[outbox_id] = asyncio.wrap_future(
+                        publisher.publish(
+                            topic,
+                            payload,
+                            ordering_key=ordering_key,
+                            **attrs,
+                        )
+                    )
+                except Exception as exc:
+                    results[outbox_id] = exc
+                    held_keys.add(ordering_key)
+
+            # The wait is bounded: a slow key must not hold its bucket locks (and this
+            # transaction) open. Unsettled publishes count as failed and their rows are
+            # retried next pass; a late ack then means a duplicate, never a lost command.
+            if pending:
+                await asyncio.wait(pending.values(), timeout=settings.OUTBOX_PUBLISH_TIMEOUT)
+            for outbox_id, future in pending.items():
+                if not future.done():
+                    future.cancel()
+                    results[outbox_id] = TimeoutError("publish not acknowledged in time")
+                elif future.exception() is not None:
+                    results[outbox_id] = future.exception()
+                else:
+                    results[outbox_id] = future.result()
+
+            published_ids = []
+            for outbox_id, topic, _, _, ordering_key in rows:
+                result = results.get(outbox_id)
+                if isinstance(result, BaseException):
+                    logger.error(
+                        "OUTBOX PUBLISH FAILED: outbox_id=%s ordering_key=%s error=%s",
+                        outbox_id,
+                        ordering_key,
+                        result,
+                    )
+                    # A failed ordered publish pauses its ordering key until it is resumed explicitly.
+                    publisher.resume_publish(topic, ordering_key)
+                elif outbox_id in pending:
+                    published_ids.append(outbox_id)
+
+            # Failed rows stay in the outbox and are retried on a later pass. The
+            # batch is deleted in one statement over the id array, whatever its size.
+            published = []
+            if published_ids:
+                published = await conn.hot["delete_published_outbox"].fetch(published_ids)
+
+    # The dispatch events go through the event writer once the delete has committed: a
+    # failing audit insert must not roll it back and have the batch published again.
+    for payment_id, operation, payload, published_at in published:
+        event_type, message = DISPATCH_EVENTS[operation]
+        await enqueue_payment_event(
+            payment_id=payment_id,
+            event_type=event_type,
+            message=message,
+            meta=payload,
+            created_at=published_at,
+        )
+
+    return len(rows)
+
+
+async def run_outbox_drainer(pool: asyncpg.Pool) -> None:
+    while True:
+        try:
+            drained = await drain_outbox_once(pool)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("OUTBOX DRAIN FAILED")
+            drained = 0
+
+        # A full batch means there is likely more waiting; otherwise idle before polling again.
+        if drained < settings.OUTBOX_BATCH_SIZE:
+            await asyncio.sleep(settings.OUTBOX_POLL_INTERVAL)
@@ -1,19 +1,45 @@
-import json
+import asyncio
+import logging
 import os
-from functools import lru_cache
+from concurrent import futures
+from functools import partial
 from typing import Any
 
+import orjson
 from google.cloud import pubsub_v1
-from google.cloud.pubsub_v1.types import PublisherOptions
+from google.cloud.pubsub_v1.types import (
+    BatchSettings,
+    LimitExceededBehavior,
+    PublishFlowControl,
+    PublisherOptions,
+)
+
+from app import settings
+
 
+logger = logging.getLogger(__name__)
 
+# Publishes no longer wait on each ack, so let concurrent requests share batches
+# and cap what can sit in memory if Pub/Sub slows down. With ordering enabled the
+# client keeps a batch per ordering key (terminal_id), flushed by latency or size.
 publisher = pubsub_v1.PublisherClient(
-    publisher_options=PublisherOptions(enable_message_ordering=True)
+    batch_settings=BatchSettings(
+        max_messages=settings.PUBSUB_BATCH_MAX_MESSAGES,
+        max_latency=settings.PUBSUB_BATCH_MAX_LATENCY,
+        max_bytes=settings.PUBSUB_BATCH_MAX_BYTES,
+    ),
+    publisher_options=PublisherOptions(
+        enable_message_ordering=True,
+        flow_control=PublishFlowControl(
+            message_limit=settings.PUBSUB_FLOW_CONTROL_MESSAGE_LIMIT,
+            byte_limit=settings.PUBSUB_FLOW_CONTROL_BYTE_LIMIT,
+            limit_exceeded_behavior=LimitExceededBehavior.BLOCK,
+        ),
+    ),
 )
 
 
-@lru_cache(maxsize=1)
-def get_commands_topic_path() -> str:
+def _resolve_commands_topic_path() -> str:
     project_id = os.getenv("GCP_PROJECT")
     topic_name = os.getenv("PUBSUB_TOPIC_NAME")
 
@@ -23,7 +49,21 @@ def get_commands_topic_path() -> str:
     if not topic_name:
         raise RuntimeError("PUBSUB_TOPIC_NAME is not set")
 
-    return f"projects/{project_id}/topics/{topic_name}"
+    return publisher.topic_path(project_id, topic_name)
+
+
+# Resolved once at import so a misconfigured deploy fails at boot, not on the first payment.
+COMMANDS_TOPIC_PATH = _resolve_commands_topic_path()
+
+
+def warm_up_publisher() -> None:
+    # Open the gRPC channel (DNS, TLS, HTTP/2) at startup rather than on the first publish.
+    # The service account may only hold pubsub.topics.publish; a permission error on
+    # get_topic still means the channel is up.
+    try:
+        publisher.get_topic(request={"topic": COMMANDS_TOPIC_PATH}, timeout=5)
+    except Exception as exc:
+        logger.info("Publisher warm-up finished with %s", exc.__class__.__name__)
 
 
 def build_payment_command(
@@ -35,18 +75,63 @@ def build_payment_command(
     idempotency_key: str | None = None,
     **extra_fields: Any,
 ) -> dict[str, Any]:
-    command = {
+    # A single dict display (no follow-up update()); orjson turns it straight into the published bytes.
+    return {
         "operation": operation,
         "payment_id": payment_id,
         "store_id": store_id,
         "terminal_id": terminal_id,
         "idempotency_key": idempotency_key,
+        **extra_fields,
     }
-    command.update(extra_fields)
-    return command
 
 
-def publish_payment_command(
+def _log_publish_result(
+    future: futures.Future,
+    *,
+    topic_path: str,
+    operation: str,
+    payment_id: str,
+    terminal_id: str,
+) -> None:
+    exc = future.exception()
+    if exc is None:
+        return
+
+    logger.error(
+        "PUBLISH FAILED: operation=%s payment_id=%s terminal_id=%s error=%s",
+        operation,
+        payment_id,
+        terminal_id,
+        exc,
+    )
+    # A failed ordered publish pauses its ordering key until it is resumed explicitly.
+    publisher.resume_publish(topic_path, terminal_id)
+
+
+def _publish(command: dict[str, Any]) -> futures.Future:
+    future = publisher.publish(
+        COMMANDS_TOPIC_PATH,
+        data=orjson.dumps(command),
+        ordering_key=command["terminal_id"],
+        # Attributes let subscribers route and filter without decoding the payload.
+        store_id=command["store_id"],
+        terminal_id=command["terminal_id"],
+        operation=command["operation"],
+    )
+    future.add_done_callback(
+        partial(
+            _log_publish_result,
+            topic_path=COMMANDS_TOPIC_PATH,
+            operation=command["operation"],
+            payment_id=command["payment_id"],
+            terminal_id=command["terminal_id"],
+        )
+    )
+    return future
+
+
+async def publish_payment_command_confirmed(
     *,
     operation: str,
     payment_id: str,
@@ -65,13 +150,8 @@ def publish_payment_command(
         **extra_fields,
     )
 
-    publisher.publish(
-        get_commands_topic_path(),
-        data=json.dumps(command).encode("utf-8"),
-        ordering_key=terminal_id,
-        store_id=store_id,
-        terminal_id=terminal_id,
-        operation=operation,
-    ).result(timeout=timeout)
+    # For callers that must know the command was accepted; awaiting the wrapped future holds no thread.
+    future = _publish(command)
+    await asyncio.wait_for(asyncio.wrap_future(future), timeout)
 
     return command
@@ -0,0 +1,420 @@
+# SQL for the hot request paths. Statements listed in HOT_STATEMENTS are prepared once
+# per pooled connection (see app.db) and executed through conn.hot[...].
+
+# Insert a PAY, claim its dispatch and queue the command in the outbox (migrations/002)
+# in one statement, so the publish cannot be lost after commit. A PAY row is therefore
+# claimed by the request that created it, and replays of it write nothing. The one
+# exception is a row written before the outbox that was never dispatched (dispatched_at
+# still NULL): its replay claims it in `rec` and queues it like a new PAY. Postgres
+# generates the payment_id and the command's correlation_id (pgcrypto, migrations/003).
+#
+# PAY, CANCEL, VOID and RETURN go through the outbox so that app.outbox publishes them
+# per terminal in the order they were written. Payloads are built here from the row
+# being written, which keeps their payment_id that of the row. GIFT is the exception:
+# app.service.gift_payments publishes directly because the request reports whether
+# Pub/Sub accepted the command, so a GIFT can reach a terminal ahead of an earlier
+# command for it that is still waiting in the outbox.
+INSERT_PAY_SQL = """
+    WITH ins AS (
+        INSERT INTO payments (
+            payment_id, merchant_id, store_id, terminal_id, ecr_reference_number, invoice_id, amount,
+            type, status, idempotency_key,
+            requested_at, created_at, updated_at, dispatched_at
+        )
+        VALUES (
+            gen_random_uuid(), $1, $2, $3, $4, $5, $6,
+            'SALE', 'IN_PROGRESS', $7,
+            now(), now(), now(), now()
+        )
+        ON CONFLICT (merchant_id, idempotency_key)
+        DO NOTHING
+        RETURNING payment_id, status, store_id, terminal_id, amount, ecr_reference_number, idempotency_key
+    ),
+    rec AS (
+        UPDATE payments
+        SET dispatched_at = now(), updated_at = now()
+        WHERE merchant_id = $1
+          AND idempotency_key = $7
+          AND dispatched_at IS NULL
+          AND status = 'IN_PROGRESS'
+          AND operation IS NULL
+          AND NOT EXISTS (SELECT 1 FROM ins)
+        RETURNING payment_id, status, store_id, terminal_id, amount, ecr_reference_number, idempotency_key
+    ),
+    box AS (
+        INSERT INTO outbox (payment_id, topic, attrs, payload, ordering_key, created_at)
+        SELECT
+            payment_id,
+            $8::text,
+            jsonb_build_object('store_id', store_id, 'terminal_id', terminal_id, 'operation', 'PAY'),
+            convert_to(json_build_object(
+                'operation', 'PAY',
+                'payment_id', payment_id,
+                'store_id', store_id,
+                'terminal_id', terminal_id,
+                'idempotency_key', idempotency_key,
+                'amount', amount::bigint,
+                'ecr_reference_number', ecr_reference_number,
+                'correlation_id', gen_random_uuid()
+            )::text, 'UTF8'),
+            terminal_id,
+            now()
+        FROM (
+            SELECT * FROM ins
+            UNION ALL
+            SELECT * FROM rec
+        ) dispatch
+    )
+    SELECT payment_id, status
+    FROM ins
+    UNION ALL
+    SELECT payment_id, status
+    FROM payments
+    WHERE merchant_id = $1
+      AND idempotency_key = $7
+      AND NOT EXISTS (SELECT 1 FROM ins)
+"""
+
+# A conflicting PAY committed after INSERT_PAY_SQL's snapshot is invisible to its
+# replay branch; that race re-reads the row on its own.
+SELECT_PAY_REPLAY_SQL = """
+    SELECT payment_id, status
+    FROM payments
+    WHERE merchant_id = $1
+      AND idempotency_key = $2
+"""
+
+# Column order is part of the contract: app.routes.payments compiles its row -> StatusResponse
+# mapper against these positions.
+SELECT_PAYMENT_COLUMNS = (
+    "merchant_id",
+    "store_id",
+    "terminal_id",
+    "type",
+    "operation",
+    "invoice_id",
+    "ecr_reference_number",
+    "status",
+    "amount",
+    "debit_credit",
+    "response_code",
+    "response_message",
+    "balance_cents",
+    "last4",
+    "created_at",
+    "updated_at",
+    "dispatched_at",
+)
+
+# StatusResponse is built with model_construct (no coercion), so cents columns are
+# cast here; a numeric column would otherwise reach the serializer as a Decimal.
+_SELECT_PAYMENT_CASTS = {
+    "amount": "amount::bigint AS amount",
+    "balance_cents": "balance_cents::bigint AS balance_cents",
+}
+
+SELECT_PAYMENT_SQL = f"""
+    SELECT
+        {", ".join(_SELECT_PAYMENT_CASTS.get(column, column) for column in SELECT_PAYMENT_COLUMNS)}
+    FROM payments
+    WHERE payment_id = $1
+"""
+
+# Transition check, status update and event insert in one statement: the UPDATE only
+# matches when the current status is an allowed predecessor ($3), and the event row
+# is written only if it did. prev reads the pre-update status for the 404/409 reply.
+APPLY_PAYMENT_EVENT_SQL = """
+    WITH prev AS (
+        SELECT status FROM payments WHERE payment_id = $1
+    ),
+    upd AS (
+        UPDATE payments
+        SET
+            status = $2,
+            updated_at = now(),
+            completed_at = CASE
+                WHEN $2 IN ('APPROVED','DECLINED','FAILED','CANCELED')
+                THEN now()
+                ELSE completed_at
+            END,
+            ecr_reference_number = COALESCE($5, ecr_reference_number),
+            terminal_reference_number = COALESCE($6, terminal_reference_number),
+            host_reference_number = COALESCE($7, host_reference_number),
+            last4 = COALESCE($8, last4)
+        WHERE payment_id = $1
+          AND status = ANY($3::text[])
+        RETURNING payment_id
+    ),
+    evt AS (
+        INSERT INTO payment_events
+            (payment_id, event_type, message, meta, created_at)
+        SELECT payment_id, $4, $2, $9::jsonb, now()
+        FROM upd
+    )
+    SELECT
+        (SELECT status FROM prev) AS current_status,
+        EXISTS (SELECT 1 FROM upd) AS updated
+"""
+
+# Cancel without a row lock: the event and its outbox command are inserted only while
+# the payment is still IN_PROGRESS. Replays with the same idempotency key hit
+# idx_pe_cancel_idem (migrations/001) and insert nothing.
+REQUEST_CANCEL_SQL = """
+    WITH chk AS (
+        SELECT payment_id, status, terminal_id, store_id
+        FROM payments
+        WHERE payment_id = $1
+    ),
+    ins AS (
+        INSERT INTO payment_events (payment_id, event_type, meta, created_at)
+        SELECT payment_id, 'CANCEL_REQUESTED', $2::jsonb, now()
+        FROM chk
+        WHERE chk.status = 'IN_PROGRESS'
+        ON CONFLICT (payment_id, (meta->>'idempotency_key'))
+            WHERE event_type = 'CANCEL_REQUESTED'
+            DO NOTHING
+        RETURNING payment_id
+    ),
+    box AS (
+        INSERT INTO outbox (payment_id, topic, attrs, payload, ordering_key, created_at)
+        SELECT
+            chk.payment_id,
+            $3::text,
+            jsonb_build_object('store_id', chk.store_id, 'terminal_id', chk.terminal_id, 'operation', 'CANCEL'),
+            convert_to(json_build_object(
+                'operation', 'CANCEL',
+                'payment_id', chk.payment_id,
+                'store_id', chk.store_id,
+                'terminal_id', chk.terminal_id,
+                'idempotency_key', $4::text
+            )::text, 'UTF8'),
+            chk.terminal_id,
+            now()
+        FROM chk
+        JOIN ins USING (payment_id)
+    )
+    SELECT
+        chk.status,
+        EXISTS (SELECT 1 FROM ins) AS inserted
+    FROM chk
+"""
+
+# Void, inside the route's row-locked transaction: record the request and, unless the
+# void was already dispatched, claim it and queue the command in the same statement.
+REQUEST_VOID_SQL = """
+    WITH evt AS (
+        INSERT INTO payment_events (payment_id, event_type, meta, created_at)
+        VALUES ($1, 'VOID_REQUESTED', $2, now())
+    ),
+    claim AS (
+        UPDATE payments
+        SET void_dispatched_at = now(), updated_at = now()
+        WHERE payment_id = $1
+          AND void_dispatched_at IS NULL
+        RETURNING
+            payment_id,
+            store_id,
+            terminal_id,
+            amount,
+            ecr_reference_number,
+            host_reference_number,
+            terminal_reference_number
+    )
+    INSERT INTO outbox (payment_id, topic, attrs, payload, ordering_key, created_at)
+    SELECT
+        payment_id,
+        $3::text,
+        jsonb_build_object('store_id', store_id, 'terminal_id', terminal_id, 'operation', 'VOID'),
+        convert_to(json_build_object(
+            'operation', 'VOID',
+            'payment_id', payment_id,
+            'store_id', store_id,
+            'terminal_id', terminal_id,
+            'idempotency_key', $4::text,
+            'amount', amount::bigint,
+            'original_ecr_reference_number', ecr_reference_number,
+            'host_reference_number', host_reference_number,
+            'reference_number', terminal_reference_number
+        )::text, 'UTF8'),
+        terminal_id,
+        now()
+    FROM claim
+"""
+
+# Return, inside the route's row-locked transaction: the event and the outbox command
+# are written together.
+REQUEST_RETURN_SQL = """
+    WITH evt AS (
+        INSERT INTO payment_events (payment_id, event_type, meta, created_at)
+        VALUES ($1, 'RETURN_REQUESTED', $2, now())
+    )
+    INSERT INTO outbox (payment_id, topic, attrs, payload, ordering_key, created_at)
+    SELECT
+        payment_id,
+        $3::text,
+        jsonb_build_object('store_id', store_id, 'terminal_id', terminal_id, 'operation', 'RETURN'),
+        convert_to(json_build_object(
+            'operation', 'RETURN',
+            'payment_id', payment_id,
+            'store_id', store_id,
+            'terminal_id', terminal_id,
+            'idempotency_key', $4::text,
+            'ecr_reference_number', $5::text,
+            'original_ecr_reference_number', ecr_reference_number,
+            'host_reference_number', host_reference_number,
+            'reference_number', terminal_reference_number
+        )::text, 'UTF8'),
+        terminal_id,
+        now()
+    FROM payments
+    WHERE payment_id = $1
+"""
+
+# Gift payments (app.service.gift_payments). Store subtype in `type`, while `operation`
+# remains the stable API command name. Postgres generates the payment_id; the payment row
+# and its CREATED event are written together, and on an idempotency conflict the replay
+# branch returns the existing row.
+CREATE_GIFT_PAYMENT_SQL = """
+    WITH ins AS (
+        INSERT INTO payments (
+            payment_id,
+            merchant_id,
+            store_id,
+            terminal_id,
+            type,
+            operation,
+            amount,
+            invoice_id,
+            ecr_reference_number,
+            status,
+            idempotency_key,
+            requested_at,
+            created_at,
+            updated_at
+        )
+        VALUES (
+            gen_random_uuid(),
+            $1,
+            $2,
+            $3,
+            $4,
+            'GIFT',
+            $5,
+            $6,
+            $7,
+            'IN_PROGRESS',
+            $8,
+            $9,
+            $9,
+            $9
+        )
+        ON CONFLICT (merchant_id, idempotency_key)
+        DO NOTHING
+        RETURNING payment_id, type, operation, status, dispatched_at, store_id, terminal_id, amount, invoice_id, ecr_reference_number
+    ),
+    evt AS (
+        INSERT INTO payment_events (payment_id, event_type, message, meta, created_at)
+        SELECT payment_id, $10, $11, $12::jsonb, $9
+        FROM ins
+    )
+    SELECT payment_id, type, operation, status, dispatched_at, store_id, terminal_id, amount, invoice_id, ecr_reference_number, TRUE AS inserted
+    FROM ins
+    UNION ALL
+    SELECT payment_id, type, operation, status, dispatched_at, store_id, terminal_id, amount, invoice_id, ecr_reference_number, FALSE AS inserted
+    FROM payments
+    WHERE merchant_id = $1
+      AND idempotency_key = $8
+      AND NOT EXISTS (SELECT 1 FROM ins)
+"""
+
+SELECT_GIFT_REPLAY_SQL = """
+    SELECT payment_id, type, operation, status, dispatched_at, store_id, terminal_id, amount, invoice_id, ecr_reference_number, FALSE AS inserted
+    FROM payments
+    WHERE merchant_id = $1
+      AND idempotency_key = $2
+    LIMIT 1
+"""
+
+CLAIM_GIFT_DISPATCH_SQL = """
+    UPDATE payments
+    SET dispatched_at = $1, updated_at = $1
+    WHERE payment_id = $2
+      AND status = 'IN_PROGRESS'
+      AND dispatched_at IS NULL
+    RETURNING dispatched_at
+"""
+
+# Publish failure: status change and FAILED event in one statement.
+MARK_GIFT_PUBLISH_FAILED_SQL = """
+    WITH upd AS (
+        UPDATE payments
+        SET
+            status = 'FAILED',
+            updated_at = $1,
+            dispatched_at = NULL,
+            response_code = $2,
+            response_message = $3
+        WHERE payment_id = $4
+        RETURNING payment_id
+    )
+    INSERT INTO payment_events (payment_id, event_type, message, meta, created_at)
+    SELECT payment_id, $5, $6, $7::jsonb, $1
+    FROM upd
+"""
+
+SELECT_PAYMENT_STATUS_SQL = """
+    SELECT status
+    FROM payments
+    WHERE payment_id = $1
+"""
+
+# Outbox drain. Pub/Sub only orders messages per ordering key within one publisher, and
+# SKIP LOCKED batches are disjoint but not ordered, so each ordering key is drained by
+# one drainer at a time. Keys hash into $1 buckets, and a drainer first takes the
+# transaction-scoped advisory lock of every bucket with pending rows that no other
+# drainer holds. The claim is a separate statement so its snapshot is taken after the
+# locks, and sees everything the previous holder of a bucket committed.
+LOCK_OUTBOX_BUCKETS_SQL = """
+    SELECT coalesce(array_agg(bucket), '{}')
+    FROM (
+        SELECT DISTINCT abs(hashtext(ordering_key) % $1) AS bucket
+        FROM outbox
+        WHERE published_at IS NULL
+    ) pending
+    WHERE pg_try_advisory_xact_lock(hashtext('payments-api.outbox'), bucket)
+"""
+
+# Oldest first, so a bucket's rows are claimed (and published) in the order written.
+CLAIM_OUTBOX_SQL = """
+    SELECT id, topic, attrs, payload, ordering_key
+    FROM outbox
+    WHERE published_at IS NULL
+      AND abs(hashtext(ordering_key) % $2) = ANY($3::int[])
+    ORDER BY id
+    LIMIT $1
+"""
+
+# Removes a whole published batch in one statement and returns what the dispatch
+# events need; the events keep the payload, so the outbox holds only pending rows.
+# statement_timestamp(), not now(): the transaction began before the publishes, and
+# published_at should be the time of the ack.
+DELETE_PUBLISHED_OUTBOX_SQL = """
+    DELETE FROM outbox
+    WHERE id = ANY($1::bigint[])
+    RETURNING payment_id, attrs->>'operation', payload, statement_timestamp() AS published_at
+"""
+
+HOT_STATEMENTS = {
+    "insert_pay": INSERT_PAY_SQL,
+    "select_pay_replay": SELECT_PAY_REPLAY_SQL,
+    "select_payment": SELECT_PAYMENT_SQL,
+    "apply_payment_event": APPLY_PAYMENT_EVENT_SQL,
+    "request_cancel": REQUEST_CANCEL_SQL,
+    "create_gift_payment": CREATE_GIFT_PAYMENT_SQL,
+    "select_gift_replay": SELECT_GIFT_REPLAY_SQL,
+    "claim_gift_dispatch": CLAIM_GIFT_DISPATCH_SQL,
+    "select_payment_status": SELECT_PAYMENT_STATUS_SQL,
+    "lock_outbox_buckets": LOCK_OUTBOX_BUCKETS_SQL,
+    "claim_outbox": CLAIM_OUTBOX_SQL,
+    "delete_published_outbox": DELETE_PUBLISHED_OUTBOX_SQL,
+}
@@ -0,0 +1,346 @@
+import logging
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import ORJSONResponse, Response
+from pydantic import TypeAdapter
+
+from app.db import get_db_conn
+from app.db_errors import is_unique_violation_for
+from app.model.payments import *
+from app.model.payment_state import ALLOWED_PREDECESSORS, ALLOWED_TRANSITIONS
+from app.pubsub import COMMANDS_TOPIC_PATH
+from app.queries import REQUEST_RETURN_SQL, REQUEST_VOID_SQL, SELECT_PAYMENT_COLUMNS
+from app.service.gift_payments import create_gift_payment
+
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+
+# Responses built from our own data skip validation: models are created with
+# model_construct and serialized to bytes here rather than re-validated by FastAPI.
+_PAY_ADAPTER = TypeAdapter(PayResponse)
+_STATUS_ADAPTER = TypeAdapter(StatusResponse)
+# Event requests are stored as their JSON encoding in payment_events.meta.
+_EVENT_ADAPTER = TypeAdapter(PaymentEventRequest)
+
+
+def _json_response(adapter: TypeAdapter, obj) -> Response:
+    return Response(content=adapter.dump_json(obj), media_type="application/json")
+
+
+def _compile_status_response_builder():
+    # Specialize the row -> StatusResponse mapping for the fixed SELECT_PAYMENT_COLUMNS
+    # order once at import, so get_payment does a single call with positional lookups.
+    index = {column: position for position, column in enumerate(SELECT_PAYMENT_COLUMNS)}
+    top_level = ", ".join(
+        f"{column}=r[{index[column]}]"
+        for column in (
+            "merchant_id",
+            "store_id",
+            "terminal_id",
+            "type",
+            "operation",
+            "invoice_id",
+            "ecr_reference_number",
+            "status",
+            "response_code",
+            "response_message",
+            "balance_cents",
+            "last4",
+        )
+    )
+    source = (
+        "def build_status_response(r):\n"
+        "    return StatusResponse.model_construct(\n"
+        f"        {top_level},\n"
+        "        amount=AmountResponse.model_construct("
+        f"amount=r[{index['amount']}], currency='USD', debitCredit=r[{index['debit_credit']}]),\n"
+        "        timestamps=Timestamps.model_construct("
+        f"created_at=r[{index['created_at']}], updated_at=r[{index['updated_at']}], "
+        f"dispatched_at=r[{index['dispatched_at']}]),\n"
+        "    )\n"
+    )
+    namespace = {
+        "StatusResponse": StatusResponse,
+        "AmountResponse": AmountResponse,
+        "Timestamps": Timestamps,
+    }
+    exec(compile(source, "<build_status_response>", "exec"), namespace)
+    return namespace["build_status_response"]
+
+
+_build_status_response = _compile_status_response_builder()
+
+
+@router.get("/payments/{payment_id}", response_model=StatusResponse)
+async def get_payment(payment_id: str, conn=Depends(get_db_conn)):
+    row = await conn.hot["select_payment"].fetchrow(payment_id)
+
+    if not row:
+        raise HTTPException(status_code=404, detail="Payment not found")
+
+    return _json_response(_STATUS_ADAPTER, _build_status_response(row))
+
+
+@router.post("/payments/gift", response_model=GiftPaymentResponse)
+async def create_gift(req: GiftPaymentRequest, conn=Depends(get_db_conn)):
+    # Keep the route thin so gift rules stay centralized in the service layer. The whole
+    # flow, publish included, runs on this one request-scoped connection.
+    return await create_gift_payment(req, conn)
+
+@router.post("/payments/pay", response_model=PayResponse)
+async def create_pay(req: PayRequest, conn=Depends(get_db_conn)):
+    try:
+        # Insert and queue the command, or return the replayed row, in one statement.
+        # Postgres generates the ids; app.outbox publishes the command after commit.
+        row = await conn.hot["insert_pay"].fetchrow(
+            req.merchant_id,
+            req.store_id,
+            req.terminal_id,
+            req.ecr_reference_number,
+            req.invoice_id,
+            req.amount,
+            req.idempotency_key,
+            COMMANDS_TOPIC_PATH,
+        )
+        if not row:
+            row = await conn.hot["select_pay_replay"].fetchrow(req.merchant_id, req.idempotency_key)
+        if not row:
+            raise HTTPException(500, "Failed to create payment")
+
+        existing_payment_id, status = row
+
+    except Exception as exc:
+        if is_unique_violation_for(exc, "ecr_reference_number"):
+            logger.warning(
+                "DUP TRANSACTION: duplicate ecr_reference_number merchant_id=%s "
+                "store_id=%s terminal_id=%s ecr_reference_number=%s idempotency_key=%s",
+                req.merchant_id,
+                req.store_id,
+                req.terminal_id,
+                req.ecr_reference_number,
+                req.idempotency_key,
+            )
+            raise HTTPException(
+                status_code=409,
+                detail="ecr_reference_number already exists",
+            ) from exc
+        raise
+
+    return _json_response(
+        _PAY_ADAPTER,
+        PayResponse.model_construct(payment_id=str(existing_payment_id), status="IN_PROGRESS"),
+    )
+
+
+# It is time to create the post command for updating status
+@router.post("/payments/{payment_id}/events")
+async def post_payment_event(payment_id: str, evt: PaymentEventRequest, conn=Depends(get_db_conn)):
+
+    row = await conn.hot["apply_payment_event"].fetchrow(
+        payment_id,
+        evt.status,
+        ALLOWED_PREDECESSORS.get(evt.status, []),
+        evt.event_type,
+        evt.ecr_reference_number,
+        evt.terminal_reference_number,
+        evt.host_reference_number,
+        evt.last4,
+        # pydantic-core serializes the model straight to JSON bytes for the jsonb bind.
+        _EVENT_ADAPTER.dump_json(evt),
+    )
+
+    # Verify payment exists
+    if row["current_status"] is None:
+        raise HTTPException(status_code=404, detail="Payment not found")
+
+    # Validate transition
+    if not row["updated"]:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Invalid transition {row['current_status']} → {evt.status}"
+        )
+
+    return ORJSONResponse({"ok": True})
+
+@router.post("/payments/{payment_id}/cancel")
+async def cancel_payment(payment_id: str, body: CancelRequest, conn=Depends(get_db_conn)):
+    try:
+        payload = {
+            "reason": body.reason,
+            "requested_by": body.requested_by,
+            "idempotency_key": body.idempotency_key or None,
+        }
+
+        # Optional idempotency: if same key already requested, don't republish.
+        # A new request queues the CANCEL in the outbox behind the terminal's earlier commands.
+        row = await conn.hot["request_cancel"].fetchrow(
+            payment_id,
+            payload,
+            COMMANDS_TOPIC_PATH,
+            body.idempotency_key,
+        )
+        if not row:
+            raise HTTPException(status_code=404, detail="Payment not found")
+
+        status, inserted = row
+
+        if status != "IN_PROGRESS":
+            raise HTTPException(
+                status_code=409,
+                detail=f"Cancel only allowed from IN_PROGRESS. Current status={status}."
+            )
+
+        if not inserted:
+            return ORJSONResponse({
+                "payment_id": payment_id,
+                "cancel_requested": True,
+                "status": status,  # still IN_PROGRESS
+            })
+
+        # Return immediately; still IN_PROGRESS
+        return ORJSONResponse({
+                    "payment_id": payment_id,
+                    "cancel_requested": True,
+                    "status": status,  # still IN_PROGRESS
+                    "test": True
+                })
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# This is if we want to void a payment, meaning the payment has already been approved. 
+@router.post("/payments/{payment_id}/void")
+async def void_payment(payment_id: str, body: VoidRequest, conn=Depends(get_db_conn)):
+    try:
+        async with conn.transaction():
+            # Lock payment row
+            row = await conn.fetchrow("""
+                SELECT status
+                FROM payments
+                WHERE payment_id = $1
+                FOR UPDATE
+            """, payment_id)
+            if not row:
+                raise HTTPException(status_code=404, detail="Payment not found")
+
+            current_status = row["status"]
+
+            # Validate: void allowed from current status
+            allowed = ALLOWED_TRANSITIONS.get(current_status, set())
+            if "VOIDED" not in allowed:
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"Void not allowed from {current_status} → VOIDED"
+                )
+
+            # Idempotency (optional): if same idempotency_key already requested, short-circuit
+            if body.idempotency_key:
+                already_requested = await conn.fetchval("""
+                    SELECT 1
+                    FROM payment_events
+                    WHERE payment_id = $1
+                      AND event_type = 'VOID_REQUESTED'
+                      AND (meta->>'idempotency_key') = $2
+                    LIMIT 1
+                """, payment_id, body.idempotency_key)
+                if already_requested:
+                    return ORJSONResponse({"payment_id": payment_id, "void_requested": True, "status": current_status})
+
+            # Insert VOID_REQUESTED event, claim void dispatch (prevents duplicate publish)
+            # and queue the VOID in the outbox in one round trip; nothing is queued if the
+            # void was already dispatched.
+            meta = {
+                "reason": body.reason,
+                "requested_by": body.requested_by,
+                "idempotency_key": body.idempotency_key,
+            }
+            await conn.execute(REQUEST_VOID_SQL, payment_id, meta, COMMANDS_TOPIC_PATH, body.idempotency_key)
+
+        return ORJSONResponse({"payment_id": payment_id, "void_requested": True, "status": current_status})
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/payments/{payment_id}/return", response_model=ReturnResponse)
+async def return_payment(payment_id: str, body: ReturnRequest, conn=Depends(get_db_conn)):
+    try:
+        async with conn.transaction():
+            row = await conn.fetchrow("""
+                SELECT
+                    status,
+                    ecr_reference_number,
+                    host_reference_number,
+                    terminal_reference_number
+                FROM payments
+                WHERE payment_id = $1
+                FOR UPDATE
+            """, payment_id)
+            if not row:
+                raise HTTPException(status_code=404, detail="Payment not found")
+
+            (
+                current_status,
+                original_ecr_reference_number,
+                host_reference_number,
+                reference_number,
+            ) = row
+
+            if current_status != "SETTLED":
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"Return only allowed from SETTLED. Current status={current_status}."
+                )
+
+            if body.idempotency_key:
+                already_requested = await conn.fetchval("""
+                    SELECT 1
+                    FROM payment_events
+                    WHERE payment_id = $1
+                      AND event_type = 'RETURN_REQUESTED'
+                      AND (meta->>'idempotency_key') = $2
+                    LIMIT 1
+                """, payment_id, body.idempotency_key)
+                if already_requested:
+                    return {
+                        "payment_id": payment_id,
+                        "return_requested": True,
+                        "status": current_status,
+                    }
+
+            payload = {
+                "ecr_reference_number": body.ecr_reference_number,
+                "original_ecr_reference_number": original_ecr_reference_number,
+                "host_reference_number": host_reference_number,
+                "reference_number": reference_number,
+                "reason": body.reason,
+                "requested_by": body.requested_by,
+                "idempotency_key": body.idempotency_key,
+            }
+
+            # RETURN_REQUESTED event and the outbox command, committed with the row lock.
+            await conn.execute(
+                REQUEST_RETURN_SQL,
+                payment_id,
+                payload,
+                COMMANDS_TOPIC_PATH,
+                body.idempotency_key,
+                body.ecr_reference_number,
+            )
+
+        return {
+            "payment_id": payment_id,
+            "return_requested": True,
+            "status": current_status,
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,80 @@
+from fastapi import APIRouter, Depends, HTTPException
+
+from app import settings
+from app.db import get_db_conn
+from app.model.payments import BatchSyncRequest, BatchSyncResponse
+
+
+router = APIRouter()
+
+
+async def get_payment_table_columns(conn) -> set[str]:
+    rows = await conn.fetch(
+        """
+        SELECT status
+        FROM payments
+        """,
+        timeout=settings.DB_BATCH_SYNC_TIMEOUT,
+    )
+    return {row[0] for row in rows}
+
+@router.post("/terminals/{terminal_id}/batch-sync", response_model=BatchSyncResponse)
+async def batch_sync_terminal_settlement(terminal_id: str, body: BatchSyncRequest, conn=Depends(get_db_conn)):
+    settlement_date = body.settlement_date
+    if settlement_date.tzinfo is None:
+        raise HTTPException(status_code=400, detail="settlement_date must include a timezone")
+
+    try:
+        async with conn.transaction():
+            total_candidates = await conn.fetchval(
+                """
+                SELECT COUNT(*)
+                FROM payments
+                WHERE status = 'APPROVED'
+                  AND dispatched_at IS NOT NULL
+                  AND dispatched_at < $1
+                """,
+                settlement_date,
+                timeout=settings.DB_BATCH_SYNC_TIMEOUT,
+            )
+
+            payment_columns = await get_payment_table_columns(conn)
+            update_assignments = [
+                "status = 'SETTLED'",
+                "updated_at = now()"
+            ]
+            update_params = []
+
+            if "completed_at" in payment_columns:
+                update_params.append(settlement_date)
+                update_assignments.append(f"completed_at = ${len(update_params)}")
+            if "settlement_batch_number" in payment_columns:
+                update_params.append(body.batch_number)
+                update_assignments.append(f"settlement_batch_number = ${len(update_params)}")
+
+            update_sql = f"""
+                UPDATE payments
+                SET {", ".join(update_assignments)}
+                WHERE status = 'APPROVED'
+                  AND approved_at IS NOT NULL
+                  AND approved_at < ${len(update_params) + 1}
+            """
+
+            # asyncpg reports the affected row count in the command tag, e.g. "UPDATE 3".
+            command_tag = await conn.execute(
+                update_sql, *update_params, settlement_date, timeout=settings.DB_BATCH_SYNC_TIMEOUT
+            )
+            updated_count = int(command_tag.split()[-1])
+
+        return BatchSyncResponse(
+            settlement_date=settlement_date,
+            batch_number=body.batch_number,
+            total_candidates=total_candidates,
+            updated_count=updated_count,
+            skipped_count=max(total_candidates - updated_count, 0),
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
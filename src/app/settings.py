@@ -0,0 +1,42 @@
+import os
+
+
+# Optional PgBouncer (transaction pooling, see deploy/pgbouncer) in front of Cloud SQL.
+# When set, the pool connects to the bouncer over TCP instead of through the connector,
+# so TLS is negotiated by asyncpg: an sslmode name ("require", "verify-full", ...).
+DB_PGBOUNCER_HOST = os.getenv("DB_PGBOUNCER_HOST") or None
+DB_PGBOUNCER_PORT = int(os.getenv("DB_PGBOUNCER_PORT", "6432"))
+DB_PGBOUNCER_SSL = os.getenv("DB_PGBOUNCER_SSL", "require")
+
+# Connection pool sizing is per worker process; total connections are workers x max size.
+# Behind PgBouncer a connection only holds a backend per transaction, so a small pool
+# per worker is enough and the bouncer's default_pool_size bounds the backends.
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "10"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10" if DB_PGBOUNCER_HOST else "50"))
+DB_POOL_MAX_INACTIVE_CONNECTION_LIFETIME = float(os.getenv("DB_POOL_MAX_INACTIVE_CONNECTION_LIFETIME", "300"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "1024"))
+# Pool-wide default for every statement; fail fast instead of tying up a pooled connection.
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "10"))
+# Terminal batch sync counts and bulk-updates across payments, so it overrides the default per call.
+DB_BATCH_SYNC_TIMEOUT = float(os.getenv("DB_BATCH_SYNC_TIMEOUT", "300"))
+
+# Outbox drainer: rows claimed per pass, and how long to idle once the outbox is empty.
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "0.2"))
+# How long a pass waits for its publishes before failing the rest, and how many
+# ordering-key buckets the drainers lock independently of each other.
+OUTBOX_PUBLISH_TIMEOUT = float(os.getenv("OUTBOX_PUBLISH_TIMEOUT", "5"))
+OUTBOX_LOCK_BUCKETS = int(os.getenv("OUTBOX_LOCK_BUCKETS", "64"))
+
+# Pub/Sub publisher batching (per ordering key) and the in-memory backlog cap.
+PUBSUB_BATCH_MAX_MESSAGES = int(os.getenv("PUBSUB_BATCH_MAX_MESSAGES", "500"))
+PUBSUB_BATCH_MAX_LATENCY = float(os.getenv("PUBSUB_BATCH_MAX_LATENCY", "0.01"))
+PUBSUB_BATCH_MAX_BYTES = int(os.getenv("PUBSUB_BATCH_MAX_BYTES", "1000000"))
+PUBSUB_FLOW_CONTROL_MESSAGE_LIMIT = int(os.getenv("PUBSUB_FLOW_CONTROL_MESSAGE_LIMIT", "10000"))
+PUBSUB_FLOW_CONTROL_BYTE_LIMIT = int(os.getenv("PUBSUB_FLOW_CONTROL_BYTE_LIMIT", str(10 * 1024 * 1024)))
+
+# Background payment_events writer: rows per COPY, how long to gather a batch, and the
+# queue bound that applies backpressure to producers if the database falls behind.
+EVENT_WRITER_BATCH_SIZE = int(os.getenv("EVENT_WRITER_BATCH_SIZE", "500"))
+EVENT_WRITER_FLUSH_INTERVAL = float(os.getenv("EVENT_WRITER_FLUSH_INTERVAL", "0.02"))
+EVENT_WRITER_QUEUE_SIZE = int(os.getenv("EVENT_WRITER_QUEUE_SIZE", "10000"))